@@ -2,7 +2,16 @@ from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
+from collections import OrderedDict
+import ast
+import asyncio
+import hashlib
 import os
+import sys
+import threading
+
+from app.refactor import ast_analyzer, refactor_rules
+from app.refactor._parse_cache import MAX_CACHED_SOURCE_SIZE, parsed
 
 app = FastAPI(title="Python Code Refactor Tool", version="1.0.0")
 
@@ -11,9 +20,17 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 static_dir = os.path.join(current_dir, "static")
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# index.html is static, so read it once at startup instead of on every request
+try:
+    with open(os.path.join(static_dir, "index.html"), "rb") as f:
+        _INDEX_HTML = f.read()
+except FileNotFoundError:
+    _INDEX_HTML = None
+
 class CodeRequest(BaseModel):
     code: str
     refactor_options: list[str] = []
+    include_suggestions: bool = True
 
 class RefactorResponse(BaseModel):
     original_code: str
@@ -21,59 +38,191 @@ class RefactorResponse(BaseModel):
     changes_made: list[str]
     suggestions: list[str]
 
+# Largest submission accepted by /refactor, in characters
+MAX_CODE_SIZE = 1_000_000
+
+# Small LRU caches so repeated submissions of the same code (e.g. toggling
+# options in the UI) skip parsing and analysis. Large submissions are never
+# cached: they are rarely resent verbatim and would dominate memory. The
+# size limit is the parse cache's, so the caches agree on what is too big.
+CACHE_SIZE = 128
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+class _LRUCache:
+    """LRU cache bounded by entry count and by the approximate size of the
+    stored strings, since one large submission can outweigh hundreds of
+    small ones"""
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        # The pipeline runs in worker threads, so updates take a lock
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+def _text_size(texts) -> int:
+    return sum(sys.getsizeof(text) for text in texts)
+
+def _cache_put(cache: _LRUCache, key, value, code: str, texts):
+    if len(code) <= MAX_CACHED_SOURCE_SIZE:
+        cache.put(key, value, _text_size(texts))
+
+_RESPONSE_CACHE = _LRUCache(CACHE_SIZE, CACHE_MAX_BYTES)
+_SUGGESTIONS_CACHE = _LRUCache(CACHE_SIZE, CACHE_MAX_BYTES)
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
-    try:
-        html_path = os.path.join(static_dir, "index.html")
-        with open(html_path, "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
-    except FileNotFoundError:
+    if _INDEX_HTML is None:
         return HTMLResponse(content="<h1>Error: index.html not found</h1>")
+    return HTMLResponse(content=_INDEX_HTML)
 
-@app.post("/refactor", response_model=RefactorResponse)
-async def refactor_code(request: CodeRequest):
+# Rules that work on the source text and never need the tree
+_LINE_BASED_OPTIONS = frozenset({"extract_duplicate"})
+
+def _run_pipeline(code: str, opts: frozenset[str], code_hash: str,
+                  include_suggestions: bool = True) -> tuple[str, list[str], list[str]]:
+    """Parse, analyze and refactor code, returning (refactored_code, changes, suggestions).
+    
+    This is CPU-bound, so refactor_code runs it in a worker thread.
+    """
+    # Suggestions only depend on the code, so they are shared across
+    # option combinations
+    suggestions = _SUGGESTIONS_CACHE.get(code_hash) if include_suggestions else []
+    
+    # Duplicate detection is line-based, so it runs on the submitted source
+    # whether or not the code parses
+    duplicate_changes = []
+    if "extract_duplicate" in opts:
+        _, duplicate_changes = refactor_rules.extract_duplicate_functions(code)
+    
+    # With no tree-based rules enabled only the suggestions need a parse
+    if opts <= _LINE_BASED_OPTIONS:
+        if suggestions is None:
+            suggestions = ast_analyzer.get_suggestions(ast_analyzer.analyze_code(code))
+            _cache_put(_SUGGESTIONS_CACHE, code_hash, suggestions, code, suggestions)
+        return code, duplicate_changes, suggestions
+    
+    # Parse once and share the tree between the analyzer and every rule.
+    # Renaming and simplifying rewrite the tree, so they need a private
+    # copy; otherwise the cached parse is reused.
+    rewrites_tree = "rename_variables" in opts or "simplify_conditionals" in opts
     try:
-        # Import here to avoid circular imports
-        from app.refactor import ast_analyzer, refactor_rules
+        tree = ast.parse(code) if rewrites_tree else parsed(code)
+    except SyntaxError as e:
+        if suggestions is None:
+            suggestions = ast_analyzer.get_suggestions(ast_analyzer.analyze_code(code))
+        return code, [f"Could not parse code: {str(e)}", *duplicate_changes], suggestions
+    
+    # Analyze the code and apply every enabled rule in a single walk
+    fused = refactor_rules.FusedRefactorPass(
+        analyze=suggestions is None,
+        rename_variables="rename_variables" in opts,
+        simplify_conditionals="simplify_conditionals" in opts,
+        extract_method="extract_method" in opts,
+        remove_dead_code="remove_dead_code" in opts
+    )
+    tree_modified = any((fused.renamer, fused.simplifier, fused.extractor, fused.cleaner))
+    if fused.analyzer or tree_modified:
+        fused.visit(tree)
+    
+    if suggestions is None:
+        suggestions = ast_analyzer.get_suggestions(fused.analyzer.get_analysis())
+        _cache_put(_SUGGESTIONS_CACHE, code_hash, suggestions, code, suggestions)
+    
+    refactored_code = code
+    changes = []
+    
+    if fused.renamer:
+        changes.extend(fused.renamer.changes_made)
         
-        # Analyze the code
-        analysis = ast_analyzer.analyze_code(request.code)
+    changes.extend(duplicate_changes)
         
-        # Apply refactoring based on options
-        refactored_code = request.code
-        changes = []
+    if fused.simplifier:
+        changes.extend(fused.simplifier.changes_made)
+    
+    # New refactoring options
+    if fused.extractor:
+        changes.extend(fused.extractor.changes_made)
         
-        if "rename_variables" in request.refactor_options:
-            refactored_code, rename_changes = refactor_rules.rename_unclear_variables(refactored_code)
-            changes.extend(rename_changes)
-            
-        if "extract_duplicate" in request.refactor_options:
-            refactored_code, extracted_changes = refactor_rules.extract_duplicate_functions(refactored_code)
-            changes.extend(extracted_changes)
-            
-        if "simplify_conditionals" in request.refactor_options:
-            refactored_code, conditional_changes = refactor_rules.simplify_complex_conditionals(refactored_code)
-            changes.extend(conditional_changes)
+    if fused.cleaner:
+        changes.extend(fused.cleaner.changes_made)
+    
+    # Serialize once, after every rule has run
+    if tree_modified:
+        refactored_code = ast.unparse(tree)
+    
+    return refactored_code, changes, suggestions
+
+@app.post("/refactor", response_model=RefactorResponse)
+async def refactor_code(request: CodeRequest):
+    # Reject pathological inputs before any parsing or hashing
+    if len(request.code) > MAX_CODE_SIZE:
+        raise HTTPException(status_code=413, detail="Code too large (>1MB)")
+    
+    try:
+        opts = frozenset(request.refactor_options)
         
-        # New refactoring options
-        if "extract_method" in request.refactor_options:
-            refactored_code, method_changes = refactor_rules.extract_method(refactored_code)
-            changes.extend(method_changes)
-            
-        if "remove_dead_code" in request.refactor_options:
-            refactored_code, dead_code_changes = refactor_rules.remove_dead_code(refactored_code)
-            changes.extend(dead_code_changes)
+        # Nothing to refactor and nothing to suggest: echo the code back
+        if not opts and not request.include_suggestions:
+            return RefactorResponse(
+                original_code=request.code,
+                refactored_code=request.code,
+                changes_made=[],
+                suggestions=[]
+            )
         
-        # Get suggestions
-        suggestions = ast_analyzer.get_suggestions(analysis)
+        # Identical code and options always produce the same response
+        code_hash = hashlib.blake2b(request.code.encode(), digest_size=16).hexdigest()
+        cache_key = (code_hash, tuple(sorted(opts)), request.include_suggestions)
+        cached = _RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Keep the event loop free for other requests while the code is processed
+        refactored_code, changes, suggestions = await asyncio.to_thread(
+            _run_pipeline, request.code, opts, code_hash, request.include_suggestions
+        )
         
-        return RefactorResponse(
+        response = RefactorResponse(
             original_code=request.code,
             refactored_code=refactored_code,
             changes_made=changes,
             suggestions=suggestions
         )
+        _cache_put(_RESPONSE_CACHE, cache_key, response, request.code,
+                   [request.code, refactored_code, *changes, *suggestions])
+        return response
         
+    except (RecursionError, MemoryError):
+        # Deeply nested code (e.g. a very long chain of operators) exhausts
+        # the recursive tree walks, and deeply bracketed code makes the
+        # parser itself raise MemoryError
+        raise HTTPException(status_code=413, detail="Code is nested too deeply to process")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing code: {str(e)}")
 
@@ -0,0 +1,24 @@
+"""
+Shared parse cache so the analyzer, metrics and read-only rules parse each
+piece of code only once
+"""
+import ast
+import functools
+
+# A parsed tree takes roughly 30x the memory of its source, so only small
+# sources are kept
+MAX_CACHED_SOURCE_SIZE = 64 * 1024
+
+def parsed(code: str) -> ast.Module:
+    """Parse code, reusing the tree from earlier calls with the same source.
+    
+    The tree is shared between callers and must not be modified; rules that
+    rewrite the tree should call ast.parse themselves.
+    """
+    if len(code) > MAX_CACHED_SOURCE_SIZE:
+        return ast.parse(code)
+    return _parsed_cached(code)
+
+@functools.lru_cache(maxsize=4)
+def _parsed_cached(code: str) -> ast.Module:
+    return ast.parse(code)
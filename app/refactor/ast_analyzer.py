@@ -1,80 +1,209 @@
 import ast
-from typing import Dict, List, Any
+import functools
+from typing import Dict, List, Any, Tuple
+
+from app.refactor._parse_cache import parsed
 
 def analyze_code(code: str) -> Dict[str, Any]:
     """Analyze Python code and return insights"""
     try:
-        tree = ast.parse(code)
+        return analyze_tree(parsed(code))
+    except SyntaxError as e:
+        return {"error": f"Syntax error: {e}", **CodeAnalyzer().get_analysis()}
+    except (RecursionError, MemoryError):
+        # Too deeply nested to parse or analyze (the parser raises
+        # MemoryError on deeply bracketed code); let the caller reject it
+        raise
+    except Exception as e:
+        return {"error": f"Analysis error: {e}", **CodeAnalyzer().get_analysis()}
+
+def analyze_tree(tree: ast.AST) -> Dict[str, Any]:
+    """Analyze an already parsed tree and return insights"""
+    try:
         analyzer = CodeAnalyzer()
         analyzer.visit(tree)
         return analyzer.get_analysis()
-    except SyntaxError as e:
-        return {"error": f"Syntax error: {e}", "long_functions": [], "unclear_variables": [], "complex_conditionals": []}
+    except (RecursionError, MemoryError):
+        raise
     except Exception as e:
-        return {"error": f"Analysis error: {e}", "long_functions": [], "unclear_variables": [], "complex_conditionals": []}
+        return {"error": f"Analysis error: {e}", **CodeAnalyzer().get_analysis()}
 
-class CodeAnalyzer(ast.NodeVisitor):
+# Single-letter names that are conventional enough not to flag
+_LOOP_COUNTERS = frozenset("ijkxyz")
+
+# Expression nodes that add to a conditional's complexity
+_CONDITIONAL_NODES = frozenset((ast.BoolOp, ast.Compare))
+
+# Contexts and operators never have children worth visiting
+_LEAF_NODES = (ast.expr_context, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
+NON_LEAF_NODES = tuple(t for t in ast.AST.__subclasses__() if t not in _LEAF_NODES)
+# Statements only ever nest inside other statements, handlers and match cases
+STATEMENT_NODES = (ast.stmt, ast.excepthandler, ast.match_case)
+
+def _node_types(bases: Tuple[type, ...]) -> List[type]:
+    """Every node class deriving from one of bases, including the bases"""
+    found = set()
+    stack = list(bases)
+    while stack:
+        node_type = stack.pop()
+        if node_type not in found:
+            found.add(node_type)
+            stack.extend(node_type.__subclasses__())
+    return list(found)
+
+class FastNodeVisitor:
+    """Drop-in replacement for ast.NodeVisitor that dispatches through a
+    per-class {node type: method} table instead of building a
+    'visit_<ClassName>' string and calling getattr for every node.
+    
+    It does not inherit from ast.NodeVisitor, which has no __slots__, so
+    subclasses that declare __slots__ get instances without a __dict__.
+    """
+    __slots__ = ()
+    _dispatch: Dict[type, Any] = {}
+    # Child node types generic_visit descends into; visitors that only look
+    # at statements narrow this to STATEMENT_NODES to skip expression subtrees
+    _descend_into: Tuple[type, ...] = NON_LEAF_NODES
+    # {child node type: visit method, or None for generic_visit}, built from
+    # _descend_into; children of any other type are skipped
+    _child_methods: Dict[type, Any] = {}
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        dispatch = {}
+        for klass in reversed(cls.__mro__):
+            for name, method in vars(klass).items():
+                node_type = getattr(ast, name[6:], None) if name.startswith("visit_") else None
+                if isinstance(node_type, type) and issubclass(node_type, ast.AST):
+                    dispatch[node_type] = method
+        cls._dispatch = dispatch
+        # Visitors that choose their walk per instance declare _child_methods
+        # as a slot, which must not be overwritten here
+        if "_child_methods" not in vars(cls):
+            cls._child_methods = cls.child_methods_for(cls._descend_into)
+    
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def child_methods_for(cls, descend_into: Tuple[type, ...]) -> Dict[type, Any]:
+        return {node_type: cls._dispatch.get(node_type) for node_type in _node_types(descend_into)}
+    
+    def visit(self, node):
+        method = self._dispatch.get(type(node))
+        if method is None:
+            return self.generic_visit(node)
+        return method(self, node)
+    
+    def generic_visit(self, node):
+        # Read the fields directly and dispatch inline rather than going
+        # through ast.iter_child_nodes and visit() for every child
+        child_methods = self._child_methods
+        for field in node._fields:
+            value = getattr(node, field, None)
+            for child in value if type(value) is list else (value,):
+                child_type = type(child)
+                if child_type in child_methods:
+                    method = child_methods[child_type]
+                    if method is None:
+                        self.generic_visit(child)
+                    else:
+                        method(self, child)
+
+class CodeAnalyzer(FastNodeVisitor):
+    __slots__ = (
+        "long_func_names", "long_func_lines", "long_func_linenos",
+        "unclear_var_names", "unclear_var_linenos", "unclear_var_contexts",
+        "complex_cond_linenos", "complex_cond_complexities", "current_function"
+    )
+    _descend_into = STATEMENT_NODES
+    
     def __init__(self):
-        self.analysis = {
-            "long_functions": [],
-            "duplicate_code": [],
-            "unclear_variables": [],
-            "complex_conditionals": [],
-            "code_smells": []
-        }
+        # Findings are kept as parallel lists per field rather than a dict
+        # per finding
+        self.long_func_names: List[str] = []
+        self.long_func_lines: List[int] = []
+        self.long_func_linenos: List[int] = []
+        self.unclear_var_names: List[str] = []
+        self.unclear_var_linenos: List[int] = []
+        self.unclear_var_contexts: List[str] = []
+        self.complex_cond_linenos: List[int] = []
+        self.complex_cond_complexities: List[int] = []
         self.current_function = None
         
     def visit_FunctionDef(self, node):
         # Track current function
         old_function = self.current_function
         self.current_function = node.name
-        
-        # Check function length
-        function_lines = node.end_lineno - node.lineno if node.end_lineno else 0
-        if function_lines > 15:
-            self.analysis["long_functions"].append({
-                "name": node.name,
-                "lines": function_lines,
-                "line": node.lineno
-            })
-        
+        self.check_function(node)
         self.generic_visit(node)
         self.current_function = old_function
     
     def visit_Assign(self, node):
+        self.check_assign(node)
+        self.generic_visit(node)
+    
+    def visit_If(self, node):
+        self.check_if(node)
+        self.generic_visit(node)
+    
+    # Per-node checks, shared with the fused refactor pass
+    
+    def check_function(self, node):
+        # Check function length
+        function_lines = node.end_lineno - node.lineno if node.end_lineno else 0
+        if function_lines > 15:
+            self.long_func_names.append(node.name)
+            self.long_func_lines.append(function_lines)
+            self.long_func_linenos.append(node.lineno)
+    
+    def check_assign(self, node):
         # Check for unclear variable names
         for target in node.targets:
             if isinstance(target, ast.Name):
                 var_name = target.id
-                if len(var_name) == 1 and var_name not in ['i', 'j', 'k', 'x', 'y', 'z']:
-                    self.analysis["unclear_variables"].append({
-                        "name": var_name,
-                        "line": node.lineno,
-                        "context": self.current_function or "global"
-                    })
-        self.generic_visit(node)
+                if len(var_name) == 1 and var_name not in _LOOP_COUNTERS:
+                    self.unclear_var_names.append(var_name)
+                    self.unclear_var_linenos.append(node.lineno)
+                    self.unclear_var_contexts.append(self.current_function or "global")
     
-    def visit_If(self, node):
+    def check_if(self, node):
         # Check complex conditionals
         complexity = self._check_conditional_complexity(node.test)
         if complexity > 2:
-            self.analysis["complex_conditionals"].append({
-                "line": node.lineno,
-                "complexity": complexity
-            })
-        self.generic_visit(node)
+            self.complex_cond_linenos.append(node.lineno)
+            self.complex_cond_complexities.append(complexity)
     
     def _check_conditional_complexity(self, node) -> int:
         """Calculate complexity of a conditional expression"""
-        if isinstance(node, (ast.BoolOp, ast.Compare)):
-            count = 1
-            for child in ast.iter_child_nodes(node):
-                count += self._check_conditional_complexity(child)
-            return count
-        return 0
+        # Iterative so deeply nested boolean expressions cannot hit the
+        # recursion limit
+        count = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if type(current) in _CONDITIONAL_NODES:
+                count += 1
+                stack.extend(ast.iter_child_nodes(current))
+        return count
     
     def get_analysis(self):
-        return self.analysis
+        return {
+            "long_functions": {
+                "name": self.long_func_names,
+                "lines": self.long_func_lines,
+                "line": self.long_func_linenos
+            },
+            "duplicate_code": [],
+            "unclear_variables": {
+                "name": self.unclear_var_names,
+                "line": self.unclear_var_linenos,
+                "context": self.unclear_var_contexts
+            },
+            "complex_conditionals": {
+                "line": self.complex_cond_linenos,
+                "complexity": self.complex_cond_complexities
+            },
+            "code_smells": []
+        }
 
 def get_suggestions(analysis: Dict[str, Any]) -> List[str]:
     """Generate human-readable suggestions from analysis"""
@@ -83,20 +212,21 @@ def get_suggestions(analysis: Dict[str, Any]) -> List[str]:
     if "error" in analysis:
         return [f"❌ {analysis['error']}"]
     
-    for long_func in analysis.get("long_functions", []):
-        suggestions.append(
-            f"📏 Function '{long_func['name']}' is {long_func['lines']} lines long. Consider breaking it into smaller functions."
-        )
+    long_functions = analysis["long_functions"]
+    suggestions += [
+        f"📏 Function '{name}' is {lines} lines long. Consider breaking it into smaller functions."
+        for name, lines in zip(long_functions["name"], long_functions["lines"])
+    ]
     
-    for var in analysis.get("unclear_variables", []):
-        suggestions.append(
-            f"🔤 Variable '{var['name']}' has an unclear name. Use more descriptive names."
-        )
+    suggestions += [
+        f"🔤 Variable '{name}' has an unclear name. Use more descriptive names."
+        for name in analysis["unclear_variables"]["name"]
+    ]
     
-    for conditional in analysis.get("complex_conditionals", []):
-        suggestions.append(
-            f"🔀 Complex conditional on line {conditional['line']}. Consider extracting to a well-named function or variable."
-        )
+    suggestions += [
+        f"🔀 Complex conditional on line {line}. Consider extracting to a well-named function or variable."
+        for line in analysis["complex_conditionals"]["line"]
+    ]
     
     if not suggestions:
         suggestions.append("✅ Code looks good! No major issues found.")
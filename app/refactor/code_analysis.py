@@ -1,37 +1,44 @@
 """
 Code analysis and smell detection utilities
 """
+import ast
+from collections import Counter
+
+from app.refactor._parse_cache import parsed
 
 def detect_code_smells(analysis: dict) -> list:
     """Detect various code smells from analysis data"""
     smells = []
     
     # Long method smell
-    for func in analysis.get("long_functions", []):
-        if func["lines"] > 15:
+    funcs = analysis["long_functions"]
+    for name, lines, line in zip(funcs["name"], funcs["lines"], funcs["line"]):
+        if lines > 15:
             smells.append({
                 "type": "LONG_METHOD",
-                "message": f"Function '{func['name']}' is too long ({func['lines']} lines)",
-                "line": func["line"],
+                "message": f"Function '{name}' is too long ({lines} lines)",
+                "line": line,
                 "severity": "MEDIUM"
             })
     
     # Unclear variable names
-    for var in analysis.get("unclear_variables", []):
+    variables = analysis["unclear_variables"]
+    for name, line in zip(variables["name"], variables["line"]):
         smells.append({
             "type": "UNCLEAR_VARIABLE",
-            "message": f"Variable '{var['name']}' has unclear name",
-            "line": var["line"],
+            "message": f"Variable '{name}' has unclear name",
+            "line": line,
             "severity": "LOW"
         })
     
     # Complex conditionals
-    for conditional in analysis.get("complex_conditionals", []):
-        if conditional["complexity"] > 3:
+    conditionals = analysis["complex_conditionals"]
+    for line, complexity in zip(conditionals["line"], conditionals["complexity"]):
+        if complexity > 3:
             smells.append({
                 "type": "COMPLEX_CONDITIONAL",
                 "message": "Overly complex conditional logic",
-                "line": conditional["line"],
+                "line": line,
                 "severity": "MEDIUM"
             })
     
@@ -40,21 +47,17 @@ def detect_code_smells(analysis: dict) -> list:
 def get_code_metrics(code: str) -> dict:
     """Calculate basic code metrics"""
     try:
-        tree = compile(code, '<string>', 'exec', ast.PyCF_ONLY_AST)
+        tree = parsed(code)
+        
+        counts = Counter(type(node) for node in ast.walk(tree))
         
         metrics = {
-            "lines_of_code": len(code.split('\n')),
-            "function_count": 0,
-            "class_count": 0,
+            "lines_of_code": code.count('\n') + 1,
+            "function_count": counts[ast.FunctionDef] + counts[ast.AsyncFunctionDef],
+            "class_count": counts[ast.ClassDef],
             "average_function_length": 0
         }
         
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                metrics["function_count"] += 1
-            elif isinstance(node, ast.ClassDef):
-                metrics["class_count"] += 1
-        
         return metrics
     except:
         return {"error": "Could not calculate metrics"}
\ No newline at end of file
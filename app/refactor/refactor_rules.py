@@ -1,6 +1,11 @@
 import ast
-import astor
-from typing import Tuple, List
+from typing import Dict, Tuple, List
+
+from app.refactor._parse_cache import parsed
+from app.refactor.ast_analyzer import CodeAnalyzer, FastNodeVisitor, NON_LEAF_NODES, STATEMENT_NODES
+
+# Single-letter names the renamer leaves alone
+_RENAMER_SKIP = frozenset("ijkxyzabcdmn")
 
 def extract_duplicate_functions(code: str) -> Tuple[str, List[str]]:
     """Find and extract duplicate code patterns into functions"""
@@ -9,16 +14,20 @@ def extract_duplicate_functions(code: str) -> Tuple[str, List[str]]:
     try:
         # Simple duplicate detection by line
         lines = code.split('\n')
-        seen_lines = {}
+        # Keyed by the hash of each stripped line; the line itself is only
+        # re-read to rule out a hash collision
+        seen_lines: Dict[int, int] = {}
         
-        for i, line in enumerate(lines):
+        for line_no, line in enumerate(lines, 1):
             stripped = line.strip()
             # Skip empty lines, comments, and very short lines
             if stripped and not stripped.startswith('#') and len(stripped) > 5:
-                if stripped in seen_lines:
-                    changes.append(f"Found duplicate code on line {i+1}: '{stripped[:40]}...'")
-                else:
-                    seen_lines[stripped] = i
+                fingerprint = hash(stripped)
+                first_line_no = seen_lines.get(fingerprint)
+                if first_line_no is None:
+                    seen_lines[fingerprint] = line_no
+                elif lines[first_line_no - 1].strip() == stripped:
+                    changes.append(f"Found duplicate code on line {line_no}: '{stripped[:40]}...'")
         
         return code, changes
         
@@ -27,22 +36,31 @@ def extract_duplicate_functions(code: str) -> Tuple[str, List[str]]:
 
 def rename_unclear_variables(code: str) -> Tuple[str, List[str]]:
     """Rename single-letter variables to more descriptive names"""
+    try:
+        tree = ast.parse(code)
+        renamer = VariableRenamer()
+        renamer.visit(tree)
+        return ast.unparse(tree), renamer.changes_made
+    except Exception as e:
+        return code, [f"Could not rename variables: {str(e)}"]
+
+def rename_unclear_variables_ast(tree: ast.AST) -> Tuple[ast.AST, List[str]]:
+    """Rename single-letter variables in an already parsed tree"""
     changes = []
     
     try:
-        tree = ast.parse(code)
         renamer = VariableRenamer()
         renamer.visit(tree)
         
         changes.extend(renamer.changes_made)
-        refactored_code = astor.to_source(tree)
-        
-        return refactored_code, changes
+        return tree, changes
         
     except Exception as e:
-        return code, [f"Could not rename variables: {str(e)}"]
+        return tree, [f"Could not rename variables: {str(e)}"]
 
-class VariableRenamer(ast.NodeVisitor):
+class VariableRenamer(FastNodeVisitor):
+    __slots__ = ("changes_made", "renamed_vars", "current_function_vars")
+    
     def __init__(self):
         self.changes_made = []
         self.renamed_vars = {}  # Track renames to update references
@@ -53,42 +71,57 @@ class VariableRenamer(ast.NodeVisitor):
         self.generic_visit(node)
         
     def visit_Assign(self, node):
+        self.rename_targets(node)
+        self.generic_visit(node)
+    
+    def visit_Name(self, node):
+        self.rename_reference(node)
+        self.generic_visit(node)
+    
+    def rename_targets(self, node):
         for target in node.targets:
             if isinstance(target, ast.Name):
                 old_name = target.id
                 # Only rename single-letter variables that aren't common loop counters
-                if len(old_name) == 1 and old_name not in ['i', 'j', 'k', 'x', 'y', 'z', 'a', 'b', 'c', 'd', 'm', 'n']:
+                if len(old_name) == 1 and old_name not in _RENAMER_SKIP:
                     new_name = f"value_{old_name}"
                     target.id = new_name
                     self.renamed_vars[old_name] = new_name
                     self.changes_made.append(f"Renamed variable '{old_name}' to '{new_name}'")
-        
-        self.generic_visit(node)
     
-    def visit_Name(self, node):
+    def rename_reference(self, node):
         # Update variable references
         if node.id in self.renamed_vars and isinstance(node.ctx, ast.Load):
             node.id = self.renamed_vars[node.id]
-        self.generic_visit(node)
 
 def simplify_complex_conditionals(code: str) -> Tuple[str, List[str]]:
     """Simplify complex if conditions"""
+    try:
+        tree = ast.parse(code)
+        simplifier = ConditionalSimplifier()
+        modified_tree = simplifier.visit(tree)
+        return ast.unparse(modified_tree), simplifier.changes_made
+    except Exception as e:
+        return code, [f"Could not simplify conditionals: {str(e)}"]
+
+def simplify_complex_conditionals_ast(tree: ast.AST) -> Tuple[ast.AST, List[str]]:
+    """Simplify complex if conditions in an already parsed tree"""
     changes = []
     
     try:
-        tree = ast.parse(code)
         simplifier = ConditionalSimplifier()
         modified_tree = simplifier.visit(tree)
         
         changes.extend(simplifier.changes_made)
-        refactored_code = astor.to_source(modified_tree)
-        
-        return refactored_code, changes
+        return modified_tree, changes
         
     except Exception as e:
-        return code, [f"Could not simplify conditionals: {str(e)}"]
+        return tree, [f"Could not simplify conditionals: {str(e)}"]
 
-class ConditionalSimplifier(ast.NodeVisitor):
+class ConditionalSimplifier(FastNodeVisitor):
+    __slots__ = ("changes_made", "conditional_count", "new_assignments")
+    _descend_into = STATEMENT_NODES
+    
     def __init__(self):
         self.changes_made = []
         self.conditional_count = 0
@@ -106,14 +139,21 @@ class ConditionalSimplifier(ast.NodeVisitor):
         # Visit all nodes in the function
         self.generic_visit(node)
         
+        self.insert_assignments(node, original_body)
+        return node
+        
+    def visit_If(self, node):
+        self.extract_conditional(node)
+        self.generic_visit(node)
+    
+    def insert_assignments(self, node, original_body):
         # Insert new assignments after the function definition but before its body
         if self.new_assignments:
             node.body = self.new_assignments + original_body
             self.new_assignments = []
-            
-        return node
-        
-    def visit_If(self, node):
+    
+    def extract_conditional(self, node):
+        """Replace a complex test with a variable and return the original test"""
         # Check if this is a complex conditional
         if isinstance(node.test, ast.BoolOp) and len(node.test.values) > 2:
             self.conditional_count += 1
@@ -133,73 +173,185 @@ class ConditionalSimplifier(ast.NodeVisitor):
             node.test = ast.Name(id=var_name, ctx=ast.Load())
             
             self.changes_made.append(f"Extracted complex conditional to variable '{var_name}'")
-        
-        self.generic_visit(node)
+            return new_assign.value
+        return None
 
 # NEW REFACTORING RULES
 
 def extract_method(code: str) -> Tuple[str, List[str]]:
     """Extract duplicate code into methods"""
+    try:
+        tree = parsed(code)
+        extractor = MethodExtractor()
+        extractor.visit(tree)
+        return ast.unparse(tree), extractor.changes_made
+    except Exception as e:
+        return code, [f"Could not extract methods: {str(e)}"]
+
+def extract_method_ast(tree: ast.AST) -> Tuple[ast.AST, List[str]]:
+    """Extract duplicate code into methods in an already parsed tree"""
     changes = []
     try:
-        tree = ast.parse(code)
         extractor = MethodExtractor()
         extractor.visit(tree)
         changes.extend(extractor.changes_made)
-        refactored_code = astor.to_source(tree)
-        return refactored_code, changes
+        return tree, changes
     except Exception as e:
-        return code, [f"Could not extract methods: {str(e)}"]
+        return tree, [f"Could not extract methods: {str(e)}"]
 
-class MethodExtractor(ast.NodeVisitor):
+class MethodExtractor(FastNodeVisitor):
+    __slots__ = ("changes_made", "duplicate_blocks")
+    _descend_into = STATEMENT_NODES
+    
     def __init__(self):
         self.changes_made = []
         self.duplicate_blocks = {}
     
     def visit_FunctionDef(self, node):
+        self.check_duplicates(node)
+        self.generic_visit(node)
+    
+    def check_duplicates(self, node):
         # Look for duplicate code patterns
         # This is a simplified version - in practice you'd analyze code blocks
-        function_body = []
+        # Bucket statements by a cheap shape key first, so only statements
+        # that could be equal are dumped and compared
+        candidates = {}
         for item in node.body:
             if isinstance(item, (ast.Assign, ast.Expr, ast.Return)):
-                function_body.append(ast.dump(item))
+                candidates.setdefault((type(item), type(item.value)), []).append(item)
         
         # Check for duplicates in function body
-        seen_lines = set()
-        for line in function_body:
-            if line in seen_lines:
+        for items in candidates.values():
+            if len(items) > 1 and self._has_duplicate(items):
                 self.changes_made.append(f"Found duplicate code pattern in function '{node.name}'")
                 break
+    
+    def _has_duplicate(self, items) -> bool:
+        seen_lines = set()
+        for item in items:
+            line = ast.dump(item)
+            if line in seen_lines:
+                return True
             seen_lines.add(line)
-        
-        self.generic_visit(node)
+        return False
 
 def remove_dead_code(code: str) -> Tuple[str, List[str]]:
     """Remove unused variables and imports"""
+    try:
+        tree = parsed(code)
+        cleaner = DeadCodeCleaner()
+        cleaner.visit(tree)
+        return ast.unparse(tree), cleaner.changes_made
+    except Exception as e:
+        return code, [f"Could not remove dead code: {str(e)}"]
+
+def remove_dead_code_ast(tree: ast.AST) -> Tuple[ast.AST, List[str]]:
+    """Remove unused variables and imports from an already parsed tree"""
     changes = []
     try:
-        tree = ast.parse(code)
         cleaner = DeadCodeCleaner()
         cleaner.visit(tree)
         changes.extend(cleaner.changes_made)
-        refactored_code = astor.to_source(tree)
-        return refactored_code, changes
+        return tree, changes
     except Exception as e:
-        return code, [f"Could not remove dead code: {str(e)}"]
+        return tree, [f"Could not remove dead code: {str(e)}"]
 
-class DeadCodeCleaner(ast.NodeVisitor):
+class DeadCodeCleaner(FastNodeVisitor):
+    __slots__ = ("changes_made", "used_vars")
+    
     def __init__(self):
         self.changes_made = []
         self.used_vars = set()
     
     def visit_Name(self, node):
-        if isinstance(node.ctx, ast.Load):
-            self.used_vars.add(node.id)
+        self.record_use(node)
         self.generic_visit(node)
     
     def visit_Assign(self, node):
+        self.check_assign(node)
+        self.generic_visit(node)
+    
+    def record_use(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.used_vars.add(node.id)
+    
+    def check_assign(self, node):
         for target in node.targets:
             if isinstance(target, ast.Name) and target.id not in self.used_vars:
                 self.changes_made.append(f"Found unused variable: {target.id}")
                 # Note: In full implementation, you'd remove this assignment
-        self.generic_visit(node)
\ No newline at end of file
+
+# FUSED PASS
+
+class FusedRefactorPass(FastNodeVisitor):
+    """Run the analyzer and every enabled rule in a single walk of the tree.
+    
+    At each node the per-node checks run in the same order the separate
+    passes would apply them (analysis, rename, simplify, extract, dead code),
+    so every rule sees the names and bodies left behind by the rules before
+    it. Each rule keeps its own changes_made list.
+    """
+    __slots__ = ("analyzer", "renamer", "simplifier", "extractor", "cleaner", "_child_methods")
+    
+    def __init__(self, analyze=True, rename_variables=False, simplify_conditionals=False,
+                 extract_method=False, remove_dead_code=False):
+        self.analyzer = CodeAnalyzer() if analyze else None
+        self.renamer = VariableRenamer() if rename_variables else None
+        self.simplifier = ConditionalSimplifier() if simplify_conditionals else None
+        self.extractor = MethodExtractor() if extract_method else None
+        self.cleaner = DeadCodeCleaner() if remove_dead_code else None
+        
+        # Only renaming and dead code detection need to see Name nodes
+        if self.renamer or self.cleaner:
+            self._child_methods = self.child_methods_for(NON_LEAF_NODES)
+        else:
+            self._child_methods = self.child_methods_for(STATEMENT_NODES)
+    
+    def visit_FunctionDef(self, node):
+        if self.analyzer:
+            old_function = self.analyzer.current_function
+            self.analyzer.current_function = node.name
+            self.analyzer.check_function(node)
+        original_body = node.body.copy()
+        extractor_index = len(self.extractor.changes_made) if self.extractor else 0
+        
+        self.generic_visit(node)
+        
+        if self.analyzer:
+            self.analyzer.current_function = old_function
+        if self.simplifier:
+            self.simplifier.insert_assignments(node, original_body)
+        if self.extractor:
+            # The body is only final once renaming and simplification have
+            # run over it, but the outer function is still reported first
+            changes = self.extractor.changes_made
+            before = len(changes)
+            self.extractor.check_duplicates(node)
+            if len(changes) > before:
+                changes.insert(extractor_index, changes.pop())
+    
+    def visit_Assign(self, node):
+        if self.analyzer:
+            self.analyzer.check_assign(node)
+        if self.renamer:
+            self.renamer.rename_targets(node)
+        if self.cleaner:
+            self.cleaner.check_assign(node)
+        self.generic_visit(node)
+    
+    def visit_If(self, node):
+        if self.analyzer:
+            self.analyzer.check_if(node)
+        if self.simplifier:
+            original_test = self.simplifier.extract_conditional(node)
+            if original_test is not None:
+                # The extracted test no longer hangs off the If node
+                self.visit(original_test)
+        self.generic_visit(node)
+    
+    def visit_Name(self, node):
+        if self.renamer:
+            self.renamer.rename_reference(node)
+        if self.cleaner:
+            self.cleaner.record_use(node)